@@ -0,0 +1,97 @@
+"""
+Buffered activity logging.
+
+Activity entries are queued in memory and written in batches by a
+background thread, so request handlers never wait on the INSERT.
+Entries are flushed every FLUSH_INTERVAL seconds and at normal exit;
+anything still queued when the process is killed outright is lost.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import ActivityLog
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background flushes
+FLUSH_INTERVAL = 2
+# Maximum rows written per INSERT; small batches keep each transaction short
+BATCH_SIZE = 40
+
+_buffer = deque()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def get_client_ip(request):
+    """Get client IP address from request."""
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        ip = x_forwarded_for.split(',')[0]
+    else:
+        ip = request.META.get('REMOTE_ADDR')
+    return ip
+
+
+def log_activity(user, action, request=None, details=None):
+    """Queue a user activity entry to be written by the background flusher."""
+    _buffer.append(ActivityLog(
+        user_id=user.pk if user else None,
+        action=action,
+        details=details or {},
+        ip_address=get_client_ip(request) if request else None,
+        user_agent=request.META.get('HTTP_USER_AGENT', '') if request else '',
+        created_at=timezone.now(),
+    ))
+    _start_flusher()
+
+
+def flush():
+    """Write all queued activity entries to the database."""
+    close_old_connections()
+    while _buffer:
+        batch = []
+        while _buffer and len(batch) < BATCH_SIZE:
+            batch.append(_buffer.popleft())
+        try:
+            with transaction.atomic():
+                ActivityLog.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+        except Exception:
+            # One bad row (say, a user deleted since it was queued) fails
+            # the whole INSERT, so retry singly and lose only that entry
+            _write_each(batch)
+
+
+def _write_each(batch):
+    for entry in batch:
+        try:
+            with transaction.atomic():
+                ActivityLog.objects.bulk_create([entry])
+        except Exception:
+            logger.exception(
+                'Dropped %r activity log entry for user %s', entry.action, entry.user_id
+            )
+
+
+def _run_flusher():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_run_flusher, name='activity-log-flusher', daemon=True)
+            _flusher.start()
+            atexit.register(flush)
@@ -4,8 +4,39 @@ Admin configuration for accounts app.
 
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from django.utils.html import format_html
-from .models import User, EmailVerification, LoginLink, ActivityLog, DataDeletionRequest
+from django.db.models import BooleanField, Case, Value, When
+from django.db.models.functions import Now
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from .models import (
+    User, EmailVerification, LoginLink, ActivityLog, DataDeletionRequest,
+    ONLINE_WINDOW, generate_verification_codes
+)
+from .tasks import send_verification_emails
+
+# Constant status badges, built once instead of per changelist row
+ONLINE_BADGE = mark_safe('<span style="color: green;">● Online</span>')
+USED_BADGE = mark_safe('<span style="color: gray;">Used</span>')
+VALID_BADGE = mark_safe('<span style="color: green;">Valid</span>')
+EXPIRED_BADGE = mark_safe('<span style="color: red;">Expired</span>')
+
+
+class OnlineFilter(admin.SimpleListFilter):
+    """Filter users by online status using the indexed last_seen column."""
+    
+    title = 'online'
+    parameter_name = 'online'
+    
+    def lookups(self, request, model_admin):
+        return [('yes', 'Online'), ('no', 'Offline')]
+    
+    def queryset(self, request, queryset):
+        cutoff = timezone.now() - ONLINE_WINDOW
+        if self.value() == 'yes':
+            return queryset.filter(last_seen__gte=cutoff)
+        if self.value() == 'no':
+            return queryset.filter(last_seen__lt=cutoff)
+        return queryset
 
 
 @admin.register(User)
@@ -13,10 +44,13 @@ class UserAdmin(BaseUserAdmin):
     """Admin configuration for User model."""
     
     list_display = [
-        'username', 'email', 'name', 'is_verified', 'is_active', 
+        'username', 'email', 'name_display', 'is_verified', 'is_active', 
         'is_staff', 'date_joined', 'last_seen_display'
     ]
-    list_filter = ['is_verified', 'is_active', 'is_staff', 'theme', 'date_joined']
+    list_filter = [
+        'is_verified', 'is_active', 'is_staff', OnlineFilter, 'theme',
+        ('date_joined', admin.DateFieldListFilter),
+    ]
     search_fields = ['username', 'email', 'name']
     ordering = ['-date_joined']
     
@@ -37,11 +71,39 @@ class UserAdmin(BaseUserAdmin):
     
     readonly_fields = ['date_joined', 'last_login', 'last_seen']
     
+    actions = ['resend_verification']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_display_name().annotate(
+            is_online_annotated=Case(
+                When(last_seen__gte=Now() - ONLINE_WINDOW, then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            )
+        )
+    
+    def name_display(self, obj):
+        return obj.display_name
+    name_display.short_description = 'Name'
+    name_display.admin_order_field = 'display_name'
+    
     def last_seen_display(self, obj):
-        if obj.is_online:
-            return format_html('<span style="color: green;">● Online</span>')
+        if obj.is_online_annotated:
+            return ONLINE_BADGE
         return obj.last_seen.strftime('%Y-%m-%d %H:%M') if obj.last_seen else 'Never'
     last_seen_display.short_description = 'Last Seen'
+    last_seen_display.admin_order_field = 'last_seen'
+    
+    def resend_verification(self, request, queryset):
+        users = list(queryset.filter(is_verified=False).only('id', 'email'))
+        EmailVerification.objects.filter(user__in=users, is_used=False).update(is_used=True)
+        verifications = EmailVerification.objects.bulk_create([
+            EmailVerification(user=user, code=code)
+            for user, code in zip(users, generate_verification_codes(len(users)))
+        ], batch_size=1000)
+        send_verification_emails([(v.user.email, v.code) for v in verifications], resend=True)
+        self.message_user(request, f'Sent {len(verifications)} verification codes.')
+    resend_verification.short_description = 'Resend verification codes to selected users'
 
 
 @admin.register(EmailVerification)
@@ -49,16 +111,19 @@ class EmailVerificationAdmin(admin.ModelAdmin):
     """Admin for email verifications."""
     
     list_display = ['user', 'code', 'created_at', 'expires_at', 'is_used', 'status']
-    list_filter = ['is_used', 'created_at']
+    list_select_related = ['user']
+    list_filter = ['is_used', ('created_at', admin.DateFieldListFilter)]
     search_fields = ['user__email', 'user__username']
+    ordering = ['-created_at']
+    autocomplete_fields = ['user']
     readonly_fields = ['code', 'created_at']
     
     def status(self, obj):
         if obj.is_used:
-            return format_html('<span style="color: gray;">Used</span>')
+            return USED_BADGE
         elif obj.is_valid:
-            return format_html('<span style="color: green;">Valid</span>')
-        return format_html('<span style="color: red;">Expired</span>')
+            return VALID_BADGE
+        return EXPIRED_BADGE
 
 
 @admin.register(LoginLink)
@@ -66,16 +131,19 @@ class LoginLinkAdmin(admin.ModelAdmin):
     """Admin for login links."""
     
     list_display = ['user', 'created_at', 'expires_at', 'is_used', 'status']
-    list_filter = ['is_used', 'created_at']
+    list_select_related = ['user']
+    list_filter = ['is_used', ('created_at', admin.DateFieldListFilter)]
     search_fields = ['user__email', 'user__username']
+    ordering = ['-created_at']
+    autocomplete_fields = ['user']
     readonly_fields = ['token', 'created_at']
     
     def status(self, obj):
         if obj.is_used:
-            return format_html('<span style="color: gray;">Used</span>')
+            return USED_BADGE
         elif obj.is_valid:
-            return format_html('<span style="color: green;">Valid</span>')
-        return format_html('<span style="color: red;">Expired</span>')
+            return VALID_BADGE
+        return EXPIRED_BADGE
 
 
 @admin.register(ActivityLog)
@@ -83,8 +151,10 @@ class ActivityLogAdmin(admin.ModelAdmin):
     """Admin for activity logs."""
     
     list_display = ['user', 'action', 'ip_address', 'created_at']
-    list_filter = ['action', 'created_at']
+    list_select_related = ['user']
+    list_filter = ['action', ('created_at', admin.DateFieldListFilter)]
     search_fields = ['user__email', 'user__username', 'ip_address']
+    ordering = ['-created_at']
     readonly_fields = ['user', 'action', 'details', 'ip_address', 'user_agent', 'created_at']
     
     def has_add_permission(self, request):
@@ -99,30 +169,24 @@ class DataDeletionRequestAdmin(admin.ModelAdmin):
     """Admin for data deletion requests."""
     
     list_display = ['user', 'status', 'requested_at', 'processed_at']
-    list_filter = ['status', 'requested_at']
+    list_select_related = ['user']
+    list_filter = ['status', ('requested_at', admin.DateFieldListFilter)]
     search_fields = ['user__email', 'user__username']
     readonly_fields = ['user', 'reason', 'requested_at']
     
     actions = ['process_deletion', 'cancel_deletion']
     
     def process_deletion(self, request, queryset):
-        for deletion_request in queryset.filter(status='pending'):
-            user = deletion_request.user
-            user.delete()
-            deletion_request.status = 'completed'
-            deletion_request.processed_at = timezone.now()
-            deletion_request.save()
-        self.message_user(request, f'Processed {queryset.count()} deletion requests.')
+        pending = queryset.filter(status='pending')
+        user_ids = list(pending.values_list('user_id', flat=True))
+        count = pending.update(status='completed', processed_at=timezone.now())
+        User.objects.filter(id__in=user_ids).delete()
+        self.message_user(request, f'Processed {count} deletion requests.')
     process_deletion.short_description = 'Process selected deletion requests'
     
     def cancel_deletion(self, request, queryset):
-        queryset.update(status='cancelled')
         # Reactivate users
-        for dr in queryset:
-            dr.user.is_active = True
-            dr.user.save()
-        self.message_user(request, f'Cancelled {queryset.count()} deletion requests.')
+        User.objects.filter(id__in=queryset.values('user_id')).update(is_active=True)
+        count = queryset.update(status='cancelled')
+        self.message_user(request, f'Cancelled {count} deletion requests.')
     cancel_deletion.short_description = 'Cancel selected deletion requests'
-
-
-from django.utils import timezone
@@ -6,6 +6,7 @@ from django import forms
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models import Q
 
 User = get_user_model()
 
@@ -57,15 +58,33 @@ class SignUpForm(forms.ModelForm):
             }),
         }
     
+    def _taken_accounts(self):
+        """Fetch taken emails and usernames once for both field validators."""
+        if self._taken is None:
+            email = self.data.get(self.add_prefix('email'), '').strip()
+            username = self.data.get(self.add_prefix('username'), '').strip()
+            rows = User._default_manager.filter(
+                Q(email__iexact=email) | Q(username__iexact=username)
+            ).values_list('email', 'username')
+            self._taken = (
+                {e.lower() for e, _ in rows},
+                {u.lower() for _, u in rows},
+            )
+        return self._taken
+    
+    def full_clean(self):
+        self._taken = None
+        super().full_clean()
+    
     def clean_email(self):
         email = self.cleaned_data.get('email').lower()
-        if User.objects.filter(email=email).exists():
+        if email in self._taken_accounts()[0]:
             raise forms.ValidationError('This email is already registered.')
         return email
     
     def clean_username(self):
         username = self.cleaned_data.get('username').lower()
-        if User.objects.filter(username=username).exists():
+        if username in self._taken_accounts()[1]:
             raise forms.ValidationError('This username is already taken.')
         if len(username) < 3:
             raise forms.ValidationError('Username must be at least 3 characters.')
@@ -87,6 +106,12 @@ class SignUpForm(forms.ModelForm):
         
         return cleaned_data
     
+    def validate_unique(self):
+        # email and username are the only unique fields on this form and are
+        # already checked by clean_email/clean_username; skip the per-field
+        # model queries.
+        pass
+    
     def save(self, commit=True):
         user = super().save(commit=False)
         user.set_password(self.cleaned_data['password'])
@@ -127,8 +152,12 @@ class EmailLoginForm(forms.Form):
     )
     
     def clean_email(self):
-        email = self.cleaned_data.get('email').lower()
-        if not User.objects.filter(email=email, is_verified=True).exists():
+        email = self.cleaned_data.get('email').strip()
+        # Keep the matched user so the view doesn't look it up again
+        self.user = User._default_manager.filter(
+            email__iexact=email, is_verified=True
+        ).only('id', 'email').first()
+        if self.user is None:
             raise forms.ValidationError('No verified account found with this email.')
         return email
 
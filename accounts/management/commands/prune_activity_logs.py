@@ -0,0 +1,42 @@
+"""
+Management command to delete old activity log entries.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.models import ActivityLog
+
+
+class Command(BaseCommand):
+    help = 'Delete activity log entries older than the retention period.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.ACTIVITY_LOG_RETENTION_DAYS,
+            help='Keep entries from the last N days.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows deleted per statement.',
+        )
+    
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timezone.timedelta(days=options['days'])
+        old_logs = ActivityLog.objects.filter(created_at__lt=cutoff)
+        
+        # Delete in bounded batches so the table is never locked for long
+        total = 0
+        while True:
+            ids = list(old_logs.values_list('pk', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted, _ = ActivityLog.objects.filter(pk__in=ids).delete()
+            total += deleted
+        
+        self.stdout.write(self.style.SUCCESS(f'Deleted {total} activity log entries.'))
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-15 09:49
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='last_seen',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-15 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_user_last_seen_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emailverification',
+            index=models.Index(condition=models.Q(('is_used', False)), fields=['user', 'expires_at'], name='emailver_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loginlink',
+            index=models.Index(condition=models.Q(('is_used', False)), fields=['user', 'expires_at'], name='loginlink_active_idx'),
+        ),
+    ]
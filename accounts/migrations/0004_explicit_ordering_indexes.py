@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-15 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_active_token_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='activitylog',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='emailverification',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='loginlink',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='user',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['-created_at'], name='activitylog_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emailverification',
+            index=models.Index(fields=['-created_at'], name='emailver_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loginlink',
+            index=models.Index(fields=['-created_at'], name='loginlink_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-date_joined'], name='user_date_joined_idx'),
+        ),
+    ]
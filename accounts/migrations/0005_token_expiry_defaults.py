@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-15 09:50
+
+import accounts.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_explicit_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailverification',
+            name='expires_at',
+            field=models.DateTimeField(default=accounts.models.verification_expiry),
+        ),
+        migrations.AlterField(
+            model_name='loginlink',
+            name='expires_at',
+            field=models.DateTimeField(default=accounts.models.login_link_expiry),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-15 09:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_case_insensitive_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailverification',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='loginlink',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
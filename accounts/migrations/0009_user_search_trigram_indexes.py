@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+# icontains compiles to UPPER(col::text) LIKE UPPER('%q%') on PostgreSQL, so
+# trigram indexes over the same expressions let user search use an index scan.
+CREATE_SQL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS user_username_trgm_idx ON accounts_user '
+    'USING gin (UPPER(username::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS user_name_trgm_idx ON accounts_user '
+    'USING gin (UPPER(name::text) gin_trgm_ops)',
+]
+
+DROP_SQL = [
+    'DROP INDEX IF EXISTS user_username_trgm_idx',
+    'DROP INDEX IF EXISTS user_name_trgm_idx',
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_activitylog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
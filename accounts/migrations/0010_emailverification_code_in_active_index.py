@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-15 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_user_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='emailverification',
+            name='emailver_active_idx',
+        ),
+        migrations.AddIndex(
+            model_name='emailverification',
+            index=models.Index(condition=models.Q(('is_used', False)), fields=['user', 'code', 'expires_at'], name='emailver_active_idx'),
+        ),
+    ]
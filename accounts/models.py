@@ -3,20 +3,67 @@ Custom User model and related models for authentication.
 """
 
 import uuid
-import random
-import string
+import secrets
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Coalesce, NullIf, Upper
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
+# How recently a user must have been seen to count as online
+ONLINE_WINDOW = timezone.timedelta(minutes=5)
+
+# Minimum interval between last_seen writes for the same user
+LAST_SEEN_THROTTLE = timezone.timedelta(seconds=30)
+
+# Seconds user search results are cached per requester and query
+USER_SEARCH_CACHE_TTL = 30
+
+# Columns read by the login, magic link and verification flows
+AUTH_FIELDS = (
+    'id', 'email', 'username', 'password', 'is_active', 'is_verified',
+    'last_login', 'last_seen',
+)
+
+
 def generate_verification_code():
     """Generate a 6-digit verification code."""
-    return ''.join(random.choices(string.digits, k=6))
+    return f'{secrets.randbelow(1_000_000):06d}'
+
+
+def generate_verification_codes(n):
+    """Generate n 6-digit verification codes for bulk issuance."""
+    randbelow = secrets.randbelow
+    return [f'{randbelow(1_000_000):06d}' for _ in range(n)]
+
+
+def verification_expiry():
+    """Expiry time for a new email verification code."""
+    return timezone.now() + timezone.timedelta(hours=1)
+
+
+def login_link_expiry():
+    """Expiry time for a new passwordless login link."""
+    return timezone.now() + timezone.timedelta(minutes=15)
 
 
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+    """QuerySet helpers for User lookups."""
+    
+    def for_auth(self):
+        """Queryset limited to the columns needed to authenticate a user."""
+        return self.only(*AUTH_FIELDS)
+    
+    def with_display_name(self):
+        """Annotate display_name (name, falling back to username) in SQL."""
+        return self.annotate(
+            display_name=Coalesce(NullIf('name', Value('')), 'username')
+        )
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     """Custom user manager for email-based authentication."""
     
     def create_user(self, email, username, password=None, **extra_fields):
@@ -42,6 +89,19 @@ class UserManager(BaseUserManager):
             raise ValueError('Superuser must have is_superuser=True.')
         
         return self.create_user(email, username, password, **extra_fields)
+    
+    def get_by_natural_key(self, username):
+        # The column is only unique case-sensitively, so rows differing just
+        # in case can exist: an exact match wins, then the oldest variant
+        field = self.model.USERNAME_FIELD
+        users = self.for_auth()
+        user = (
+            users.filter(**{field: username}).first()
+            or users.filter(**{f'{field}__iexact': username}).order_by('date_joined').first()
+        )
+        if user is None:
+            raise self.model.DoesNotExist(f'No user with {field} {username!r}')
+        return user
 
 
 def user_profile_pic_path(instance, filename):
@@ -54,6 +114,9 @@ def user_profile_pic_path(instance, filename):
 class User(AbstractBaseUser, PermissionsMixin):
     """Custom User model with email authentication."""
     
+    # Production runs on PostgreSQL, which stores UUIDField as a native
+    # 16-byte uuid column, so FK joins on User.id stay compact. Only the
+    # SQLite development database falls back to char(32).
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     email = models.EmailField(unique=True, max_length=255)
     username = models.CharField(unique=True, max_length=50)
@@ -85,7 +148,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     
     # Timestamps
     date_joined = models.DateTimeField(default=timezone.now)
-    last_seen = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now, db_index=True)
     
     objects = UserManager()
     
@@ -93,7 +156,13 @@ class User(AbstractBaseUser, PermissionsMixin):
     REQUIRED_FIELDS = ['username', 'name']
     
     class Meta:
-        ordering = ['-date_joined']
+        # No default ordering: admin and callers that need it order explicitly
+        indexes = [
+            models.Index(fields=['-date_joined'], name='user_date_joined_idx'),
+            # Match the UPPER() that iexact lookups compile to on PostgreSQL
+            models.Index(Upper('email'), name='user_email_ci_idx'),
+            models.Index(Upper('username'), name='user_username_ci_idx'),
+        ]
     
     def __str__(self):
         return self.username
@@ -102,15 +171,26 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.name or self.username
     
     def update_last_seen(self):
-        self.last_seen = timezone.now()
-        self.save(update_fields=['last_seen'])
+        from .presence import mark_online, mark_seen
+        
+        now = timezone.now()
+        # Skip the write if we already recorded a recent visit
+        if self.last_seen and now - self.last_seen < LAST_SEEN_THROTTLE:
+            mark_online(self.pk)
+            return
+        # Recorded in the cache now and written back to the row in batches
+        mark_seen(self.pk, now)
+        self.last_seen = now
     
     @property
     def is_online(self):
-        """Check if user was active in the last 5 minutes."""
-        if self.last_seen:
-            return (timezone.now() - self.last_seen).total_seconds() < 300
-        return False
+        """Check if user is connected, or was active in the last 5 minutes."""
+        from .presence import online_user_ids
+        
+        # Lists resolve this for every user at once via prefetch_online()
+        if '_online' not in self.__dict__:
+            self._online = self.pk in online_user_ids([self])
+        return self._online
 
 
 class EmailVerification(models.Model):
@@ -118,17 +198,21 @@ class EmailVerification(models.Model):
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='verifications')
     code = models.CharField(max_length=6, default=generate_verification_code)
-    created_at = models.DateTimeField(auto_now_add=True)
-    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    expires_at = models.DateTimeField(default=verification_expiry)
     is_used = models.BooleanField(default=False)
     
     class Meta:
-        ordering = ['-created_at']
-    
-    def save(self, *args, **kwargs):
-        if not self.expires_at:
-            self.expires_at = timezone.now() + timezone.timedelta(hours=1)
-        super().save(*args, **kwargs)
+        indexes = [
+            models.Index(fields=['-created_at'], name='emailver_created_idx'),
+            # Only unused codes are ever looked up, so keep them out of the
+            # index; code is included so verification resolves in the index
+            models.Index(
+                fields=['user', 'code', 'expires_at'],
+                condition=models.Q(is_used=False),
+                name='emailver_active_idx',
+            ),
+        ]
     
     @property
     def is_valid(self):
@@ -143,17 +227,19 @@ class LoginLink(models.Model):
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='login_links')
     token = models.UUIDField(default=uuid.uuid4, unique=True)
-    created_at = models.DateTimeField(auto_now_add=True)
-    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    expires_at = models.DateTimeField(default=login_link_expiry)
     is_used = models.BooleanField(default=False)
     
     class Meta:
-        ordering = ['-created_at']
-    
-    def save(self, *args, **kwargs):
-        if not self.expires_at:
-            self.expires_at = timezone.now() + timezone.timedelta(minutes=15)
-        super().save(*args, **kwargs)
+        indexes = [
+            models.Index(fields=['-created_at'], name='loginlink_created_idx'),
+            models.Index(
+                fields=['user', 'expires_at'],
+                condition=models.Q(is_used=False),
+                name='loginlink_active_idx',
+            ),
+        ]
     
     @property
     def is_valid(self):
@@ -189,10 +275,12 @@ class ActivityLog(models.Model):
     details = models.JSONField(default=dict, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
-        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='activitylog_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user} - {self.action} at {self.created_at}"
@@ -0,0 +1,118 @@
+"""
+Cache-backed presence tracking.
+
+Visits are recorded in the cache on the hot path and written back to
+User.last_seen in batches by a background thread, so logins and
+WebSocket connects don't each UPDATE the user row.
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import User, ONLINE_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# Seconds between last_seen write-backs
+FLUSH_INTERVAL = 60
+# Seconds a last_seen timestamp is kept in the cache
+LAST_SEEN_TTL = 60 * 60 * 24
+# Seconds a user stays online without another visit; WebSocket clients
+# send a heartbeat every 30 seconds to keep this alive
+PRESENCE_TTL = 60
+
+_pending = {}
+_pending_lock = threading.Lock()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _online_key(user_id):
+    return f'online:{user_id}'
+
+
+def _last_seen_key(user_id):
+    return f'lastseen:{user_id}'
+
+
+def mark_online(user_id):
+    """Refresh the user's presence key without touching last_seen."""
+    cache.set(_online_key(user_id), 1, PRESENCE_TTL)
+
+
+def mark_seen(user_id, when=None):
+    """Record a visit in the cache and queue it for the database."""
+    when = when or timezone.now()
+    cache.set(_last_seen_key(user_id), when, LAST_SEEN_TTL)
+    mark_online(user_id)
+    with _pending_lock:
+        _pending[user_id] = when
+    _start_flusher()
+
+
+def online_user_ids(users):
+    """
+    Ids of the given users who are online, read with one cache round-trip.
+    
+    With a shared cache the presence key decides, so a user drops offline
+    within PRESENCE_TTL of their last heartbeat. A per-process cache can't
+    see other workers' keys, so there last_seen within ONLINE_WINDOW decides.
+    """
+    if not settings.PRESENCE_FROM_CACHE:
+        cutoff = timezone.now() - ONLINE_WINDOW
+        return {user.pk for user in users if user.last_seen and user.last_seen > cutoff}
+    keys = {_online_key(user.pk): user.pk for user in users}
+    if not keys:
+        return set()
+    return {keys[key] for key in cache.get_many(list(keys))}
+
+
+def prefetch_online(users):
+    """
+    Resolve is_online for many users at once so serializing a list costs
+    one cache read instead of one per user.
+    """
+    users = [user for user in users if user is not None]
+    online = online_user_ids(users)
+    for user in users:
+        user._online = user.pk in online
+    return users
+
+
+def flush():
+    """Write queued last_seen timestamps to the database."""
+    global _pending
+    with _pending_lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return
+    close_old_connections()
+    users = [User(pk=user_id, last_seen=when) for user_id, when in pending.items()]
+    try:
+        User.objects.bulk_update(users, ['last_seen'], batch_size=500)
+    except Exception:
+        logger.exception('Failed to write last_seen for %d users', len(users))
+
+
+def _run_flusher():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_run_flusher, name='last-seen-flusher', daemon=True)
+            _flusher.start()
+            atexit.register(flush)
@@ -0,0 +1,75 @@
+"""
+Background email delivery.
+
+Emails are handed to a small worker pool so views return as soon as the
+message is queued instead of waiting on the SMTP round-trip.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import send_mail, send_mass_mail
+
+logger = logging.getLogger(__name__)
+
+# Kept small so a slow SMTP server cannot tie up many threads
+EMAIL_WORKERS = 2
+
+_executor = ThreadPoolExecutor(max_workers=EMAIL_WORKERS, thread_name_prefix='email')
+
+
+def _send(subject, message, recipient):
+    try:
+        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [recipient], fail_silently=False)
+    except Exception:
+        logger.exception('Failed to send "%s" email to %s', subject, recipient)
+
+
+def _send_mass(datatuple):
+    try:
+        send_mass_mail(datatuple, fail_silently=False)
+    except Exception:
+        logger.exception('Failed to send %d emails', len(datatuple))
+
+
+def _verification_email(code, resend=False):
+    """Subject and body of a verification code email."""
+    if resend:
+        return (
+            'Your new verification code',
+            f'Your new verification code is: {code}\n\nThis code expires in 1 hour.',
+        )
+    return 'Verify your Chatty account', f'''
+Welcome to Chatty!
+
+Your verification code is: {code}
+
+This code will expire in 1 hour.
+
+If you didn't create this account, please ignore this email.
+            '''
+
+
+def send_verification_email(email, code, resend=False):
+    """Queue an email carrying a verification code."""
+    subject, message = _verification_email(code, resend)
+    _executor.submit(_send, subject, message, email)
+
+
+def send_verification_emails(codes, resend=False):
+    """Queue verification codes for many (email, code) pairs over one SMTP connection."""
+    _executor.submit(_send_mass, [
+        (*_verification_email(code, resend), settings.DEFAULT_FROM_EMAIL, [email])
+        for email, code in codes
+    ])
+
+
+def send_magic_link(email, url):
+    """Queue an email carrying a passwordless login link."""
+    _executor.submit(
+        _send,
+        'Your Chatty login link',
+        f'Click here to log in: {url}\n\nThis link expires in 15 minutes.',
+        email,
+    )
@@ -2,19 +2,24 @@
 Views for user authentication, registration, and profile management.
 """
 
+import hashlib
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate, get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.mail import send_mail
-from django.conf import settings
 from django.urls import reverse
-from django.utils import timezone
 from django.http import JsonResponse
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.db.models import Q
 from django.views.decorators.http import require_POST, require_GET
 from django.template.loader import render_to_string
 
-from .models import EmailVerification, LoginLink, ActivityLog
+from .activity import log_activity
+from .presence import prefetch_online
+from .tasks import send_verification_email, send_magic_link
+from .models import EmailVerification, LoginLink, USER_SEARCH_CACHE_TTL
 from .forms import (
     SignUpForm, LoginForm, EmailLoginForm, VerificationCodeForm,
     ProfileUpdateForm, PasswordChangeForm, DeleteAccountForm
@@ -23,27 +28,6 @@ from .forms import (
 User = get_user_model()
 
 
-def get_client_ip(request):
-    """Get client IP address from request."""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
-
-
-def log_activity(user, action, request=None, details=None):
-    """Log user activity."""
-    ActivityLog.objects.create(
-        user=user,
-        action=action,
-        details=details or {},
-        ip_address=get_client_ip(request) if request else None,
-        user_agent=request.META.get('HTTP_USER_AGENT', '') if request else ''
-    )
-
-
 def signup_view(request):
     """Handle user registration."""
     if request.user.is_authenticated:
@@ -52,33 +36,17 @@ def signup_view(request):
     if request.method == 'POST':
         form = SignUpForm(request.POST)
         if form.is_valid():
-            user = form.save()
+            try:
+                user = form.save()
+            except IntegrityError:
+                # Lost a race with a concurrent signup for the same email/username
+                form.add_error(None, 'This email or username is already registered.')
+                return render(request, 'accounts/signup.html', {'form': form})
             
             # Create verification code
             verification = EmailVerification.objects.create(user=user)
             
-            # Send verification email
-            subject = 'Verify your Chatty account'
-            message = f'''
-Welcome to Chatty!
-
-Your verification code is: {verification.code}
-
-This code will expire in 1 hour.
-
-If you didn't create this account, please ignore this email.
-            '''
-            try:
-                send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [user.email],
-                    fail_silently=False,
-                )
-            except Exception as e:
-                # In development, just log the code
-                print(f"Verification code for {user.email}: {verification.code}")
+            send_verification_email(user.email, verification.code)
             
             # Store user ID in session for verification
             request.session['pending_verification_user'] = str(user.id)
@@ -99,7 +67,7 @@ def verify_email_view(request):
         messages.error(request, 'No pending verification found.')
         return redirect('accounts:signup')
     
-    user = get_object_or_404(User, id=user_id)
+    user = get_object_or_404(User.objects.for_auth(), id=user_id)
     
     if request.method == 'POST':
         form = VerificationCodeForm(request.POST)
@@ -110,14 +78,14 @@ def verify_email_view(request):
                 user=user,
                 code=code,
                 is_used=False
-            ).first()
+            ).order_by('-created_at').first()
             
             if verification and verification.is_valid:
                 verification.is_used = True
                 verification.save()
                 
                 user.is_verified = True
-                user.save()
+                user.save(update_fields=['is_verified'])
                 
                 # Clear session
                 del request.session['pending_verification_user']
@@ -144,7 +112,7 @@ def resend_verification_view(request):
     if not user_id:
         return JsonResponse({'error': 'No pending verification'}, status=400)
     
-    user = get_object_or_404(User, id=user_id)
+    user = get_object_or_404(User.objects.for_auth(), id=user_id)
     
     # Invalidate old codes
     EmailVerification.objects.filter(user=user, is_used=False).update(is_used=True)
@@ -152,17 +120,7 @@ def resend_verification_view(request):
     # Create new verification
     verification = EmailVerification.objects.create(user=user)
     
-    # Send email
-    try:
-        send_mail(
-            'Your new verification code',
-            f'Your new verification code is: {verification.code}\n\nThis code expires in 1 hour.',
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-            fail_silently=False,
-        )
-    except Exception:
-        print(f"New verification code for {user.email}: {verification.code}")
+    send_verification_email(user.email, verification.code, resend=True)
     
     return JsonResponse({'success': True, 'message': 'New code sent!'})
 
@@ -175,7 +133,7 @@ def login_view(request):
     if request.method == 'POST':
         form = LoginForm(request.POST)
         if form.is_valid():
-            email = form.cleaned_data['email'].lower()
+            email = form.cleaned_data['email'].strip()
             password = form.cleaned_data['password']
             remember_me = form.cleaned_data.get('remember_me', False)
             
@@ -186,7 +144,7 @@ def login_view(request):
                     # Send to verification
                     request.session['pending_verification_user'] = str(user.id)
                     verification = EmailVerification.objects.create(user=user)
-                    print(f"Verification code for {user.email}: {verification.code}")
+                    send_verification_email(user.email, verification.code)
                     messages.info(request, 'Please verify your email first.')
                     return redirect('accounts:verify_email')
                 
@@ -215,8 +173,7 @@ def email_login_view(request):
     if request.method == 'POST':
         form = EmailLoginForm(request.POST)
         if form.is_valid():
-            email = form.cleaned_data['email']
-            user = User.objects.get(email=email)
+            user = form.user
             
             # Create login link
             login_link = LoginLink.objects.create(user=user)
@@ -226,19 +183,9 @@ def email_login_view(request):
                 reverse('accounts:magic_login', kwargs={'token': login_link.token})
             )
             
-            # Send email
-            try:
-                send_mail(
-                    'Your Chatty login link',
-                    f'Click here to log in: {login_url}\n\nThis link expires in 15 minutes.',
-                    settings.DEFAULT_FROM_EMAIL,
-                    [email],
-                    fail_silently=False,
-                )
-                messages.success(request, 'Login link sent! Check your email.')
-            except Exception:
-                print(f"Login link for {email}: {login_url}")
-                messages.success(request, 'Login link sent! Check your email (or console in development).')
+            # The typed address may differ in case; mail the stored one
+            send_magic_link(user.email, login_url)
+            messages.success(request, 'Login link sent! Check your email.')
             
             return redirect('accounts:login')
     else:
@@ -260,7 +207,7 @@ def magic_login_view(request, token):
     login_link.save()
     
     # Log user in
-    user = login_link.user
+    user = User.objects.for_auth().get(pk=login_link.user_id)
     login(request, user)
     
     log_activity(user, 'login', request, {'method': 'magic_link'})
@@ -362,14 +309,20 @@ def user_search_view(request):
     if len(query) < 2:
         return JsonResponse({'users': []})
     
+    # Autocomplete retypes the same prefixes, so reuse recent results briefly
+    query_hash = hashlib.md5(query.lower().encode()).hexdigest()
+    cache_key = f'usearch:{request.user.id}:{query_hash}'
+    results = cache.get(cache_key)
+    if results is not None:
+        return JsonResponse({'users': results})
+    
     users = User.objects.filter(
+        Q(username__icontains=query) | Q(name__icontains=query),
         is_active=True,
         is_verified=True
     ).exclude(
         id=request.user.id
-    ).filter(
-        models.Q(username__icontains=query) | models.Q(name__icontains=query)
-    )[:10]
+    ).only('id', 'username', 'name', 'profile_pic', 'last_seen')[:10]
     
     results = [{
         'id': str(user.id),
@@ -377,10 +330,7 @@ def user_search_view(request):
         'name': user.name,
         'profile_pic': user.profile_pic.url if user.profile_pic else None,
         'is_online': user.is_online,
-    } for user in users]
+    } for user in prefetch_online(users)]
+    cache.set(cache_key, results, USER_SEARCH_CACHE_TTL)
     
     return JsonResponse({'users': results})
-
-
-# Import models for user search
-from django.db import models
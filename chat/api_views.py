@@ -2,16 +2,47 @@
 API views for chat functionality.
 """
 
+import hashlib
+import random
+import uuid
+
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q, Max
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from django.db.models import Q, Exists, OuterRef
+from django.db import transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from .models import Conversation, Message, AIBot
+from .models import (
+    Conversation, ConversationParticipant, Message, AIBot,
+    touch_conversation, attach_unread_counts
+)
 from .serializers import ConversationSerializer, MessageSerializer, UserSerializer
-from accounts.models import User
+from accounts.models import User, ONLINE_WINDOW, USER_SEARCH_CACHE_TTL
+from accounts.presence import prefetch_online
+
+
+def is_participant(user, **filters):
+    """EXISTS test for membership, probing the (conversation, user) unique index."""
+    return Exists(ConversationParticipant.objects.filter(
+        conversation=OuterRef('pk'),
+        user=user,
+        **filters
+    ))
+
+
+class ConversationCursorPagination(CursorPagination):
+    """Cursor pagination over the most recently active conversations."""
+    
+    page_size = 20
+    ordering = '-last_message_time'
 
 
 class ConversationListAPIView(generics.ListAPIView):
@@ -19,14 +50,25 @@ class ConversationListAPIView(generics.ListAPIView):
     
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ConversationCursorPagination
     
     def get_queryset(self):
-        return Conversation.objects.filter(
-            participants=self.request.user,
-            conversation_participants__is_archived=False
-        ).annotate(
-            last_message_time=Max('messages__created_at')
-        ).order_by('-last_message_time')
+        # Participants, the latest message and the read marker are all
+        # loaded up front so the serializer never queries per conversation.
+        return Conversation.objects.for_chat_list(self.request.user).only(
+            'id', 'name', 'conversation_type', 'created_at', 'updated_at',
+            'group_image', 'description'
+        )
+    
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            page = attach_unread_counts(page, self.request.user)
+            prefetch_online(
+                [user for conv in page for user in conv.participants.all()]
+                + [message.sender for conv in page for message in conv.latest_messages]
+            )
+        return page
 
 
 class ConversationDetailAPIView(generics.RetrieveAPIView):
@@ -36,7 +78,14 @@ class ConversationDetailAPIView(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Conversation.objects.filter(participants=self.request.user)
+        return Conversation.objects.filter(
+            is_participant(self.request.user)
+        ).prefetch_related('participants')
+    
+    def get_object(self):
+        conversation = super().get_object()
+        prefetch_online(conversation.participants.all())
+        return conversation
 
 
 class MessageListAPIView(generics.ListAPIView):
@@ -47,12 +96,44 @@ class MessageListAPIView(generics.ListAPIView):
     
     def get_queryset(self):
         conversation_id = self.kwargs['conversation_id']
-        conversation = get_object_or_404(
-            Conversation,
-            id=conversation_id,
-            participants=self.request.user
-        )
-        return conversation.messages.select_related('sender').order_by('-created_at')[:50]
+        if not ConversationParticipant.objects.filter(
+            conversation_id=conversation_id,
+            user=self.request.user
+        ).exists():
+            raise Http404
+        messages = Message.objects.filter(
+            conversation_id=conversation_id
+        ).select_related('sender').only(
+            'id', 'conversation_id', 'message_type', '_content', 'file', 'file_name',
+            'file_size', 'created_at', 'is_edited', 'is_deleted', 'reply_to_id',
+            'sender__id', 'sender__username', 'sender__name', 'sender__bio',
+            'sender__profile_pic', 'sender__last_seen'
+        ).order_by('-created_at', '-id')
+        
+        # Keyset pagination: ?before=<created_at>&before_id=<id> of the oldest message seen
+        before = self.request.query_params.get('before')
+        if before:
+            before_at = parse_datetime(before)
+            if before_at is None:
+                raise ValidationError({'before': 'Invalid datetime.'})
+            before_id = self.request.query_params.get('before_id')
+            if before_id:
+                try:
+                    before_id = uuid.UUID(before_id)
+                except ValueError:
+                    raise ValidationError({'before_id': 'Invalid id.'})
+                messages = messages.filter(
+                    Q(created_at__lt=before_at) | Q(created_at=before_at, id__lt=before_id)
+                )
+            else:
+                messages = messages.filter(created_at__lt=before_at)
+        
+        return messages[:50]
+    
+    def list(self, request, *args, **kwargs):
+        messages = list(self.filter_queryset(self.get_queryset()))
+        prefetch_online(message.sender for message in messages)
+        return Response(self.get_serializer(messages, many=True).data)
 
 
 class UserSearchAPIView(APIView):
@@ -66,17 +147,23 @@ class UserSearchAPIView(APIView):
         if len(query) < 2:
             return Response({'users': []})
         
+        query_hash = hashlib.md5(query.lower().encode()).hexdigest()
+        cache_key = f'usearch-api:{request.user.id}:{query_hash}'
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response({'users': data})
+        
         users = User.objects.filter(
+            Q(username__icontains=query) | Q(name__icontains=query),
             is_active=True,
             is_verified=True
         ).exclude(
             id=request.user.id
-        ).filter(
-            Q(username__icontains=query) | Q(name__icontains=query)
-        )[:10]
+        ).only('id', 'username', 'name', 'bio', 'profile_pic', 'last_seen')[:10]
         
-        serializer = UserSerializer(users, many=True)
-        return Response({'users': serializer.data})
+        data = UserSerializer(prefetch_online(users), many=True).data
+        cache.set(cache_key, data, USER_SEARCH_CACHE_TTL)
+        return Response({'users': data})
 
 
 class OnlineUsersAPIView(APIView):
@@ -85,13 +172,18 @@ class OnlineUsersAPIView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        # Get users from user's conversations who are online
-        conversation_users = User.objects.filter(
-            conversations__in=request.user.conversations.all()
-        ).exclude(id=request.user.id).distinct()
+        # Peers from the user's conversations; IN dedupes them, so no DISTINCT
+        peer_ids = ConversationParticipant.objects.filter(
+            conversation__conversation_participants__user=request.user
+        ).exclude(user=request.user).values('user_id')
         
-        online_users = [u for u in conversation_users if u.is_online]
+        online_users = User.objects.filter(
+            id__in=peer_ids,
+            last_seen__gte=timezone.now() - ONLINE_WINDOW
+        ).only('id', 'username', 'name', 'bio', 'profile_pic', 'last_seen')
         
+        # last_seen narrows the candidates; presence has the final say
+        online_users = [user for user in prefetch_online(online_users) if user.is_online]
         serializer = UserSerializer(online_users, many=True)
         return Response({'users': serializer.data})
 
@@ -113,32 +205,32 @@ class AIChatAPIView(APIView):
             )
         
         conversation = get_object_or_404(
-            Conversation,
+            Conversation.objects.filter(is_participant(request.user)),
             id=conversation_id,
-            participants=request.user,
             conversation_type='ai'
         )
         
-        # Save user message
+        # Generate AI response (placeholder - integrate with actual AI API)
+        ai_response = self.generate_ai_response(message, conversation)
+        
+        # Build both messages, encrypting before the transaction opens
         user_message = Message(
             conversation=conversation,
             sender=request.user,
             message_type='text',
         )
         user_message.content = message
-        user_message.save()
-        
-        # Generate AI response (placeholder - integrate with actual AI API)
-        ai_response = self.generate_ai_response(message, conversation)
-        
-        # Save AI response
         ai_message = Message(
             conversation=conversation,
             sender=None,
             message_type='ai',
         )
         ai_message.content = ai_response
-        ai_message.save()
+        
+        with transaction.atomic():
+            Message.objects.bulk_create([user_message, ai_message])
+        # bulk_create skips Message.save(), so bump updated_at here
+        touch_conversation(conversation.pk)
         
         return Response({
             'user_message': user_message.to_dict(),
@@ -159,5 +251,4 @@ class AIChatAPIView(APIView):
             "Thanks for sharing. What would you like to explore further?",
         ]
         
-        import random
         return random.choice(responses)
@@ -9,3 +9,6 @@ class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
     verbose_name = 'Chat & Messaging'
+    
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -2,13 +2,30 @@
 WebSocket consumers for real-time chat functionality.
 """
 
-import json
+import asyncio
+import uuid
+
+import orjson
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
 from django.utils import timezone
 from asgiref.sync import sync_to_async
 
 
+# Seconds a verified conversation membership is cached for reconnects
+PARTICIPANT_CACHE_TTL = 300
+# Seconds incoming messages are collected before being saved together
+MESSAGE_BATCH_WINDOW = 0.02
+
+
+def dumps(data):
+    """Serialize a WebSocket frame; orjson is several times faster than json."""
+    return orjson.dumps(data).decode()
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
     """WebSocket consumer for chat functionality."""
     
@@ -20,8 +37,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
+        # Compared against every typing/status event, so stringify once
+        self.user_id = str(self.user.id)
+        # Canonical form, so cache keys and group names match however the id is spelled
+        try:
+            self.conversation_id = str(uuid.UUID(self.scope['url_route']['kwargs']['conversation_id']))
+        except ValueError:
+            await self.close()
+            return
         self.room_group_name = f'chat_{self.conversation_id}'
+        self.pending_messages = []
+        self.flush_task = None
         
         # Verify user is participant
         is_participant = await self.check_participant()
@@ -45,7 +71,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             {
                 'type': 'user_status',
-                'user_id': str(self.user.id),
+                'user_id': self.user_id,
                 'username': self.user.username,
                 'is_online': True,
             }
@@ -53,13 +79,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection."""
+        # Don't drop messages still waiting for the batch window
+        if getattr(self, 'flush_task', None):
+            await self.flush_task
+        
         if hasattr(self, 'room_group_name'):
             # Notify others that user went offline
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
                     'type': 'user_status',
-                    'user_id': str(self.user.id),
+                    'user_id': self.user_id,
                     'username': self.user.username,
                     'is_online': False,
                 }
@@ -78,7 +108,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def receive(self, text_data):
         """Handle incoming WebSocket message."""
         try:
-            data = json.loads(text_data)
+            data = orjson.loads(text_data)
             message_type = data.get('type', 'message')
             
             if message_type == 'message':
@@ -89,8 +119,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 await self.handle_read(data)
             elif message_type == 'delete':
                 await self.handle_delete(data)
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            elif message_type == 'heartbeat':
+                await self.update_user_status(online=True)
+        except orjson.JSONDecodeError:
+            await self.send(text_data=dumps({
                 'type': 'error',
                 'message': 'Invalid JSON'
             }))
@@ -103,16 +135,29 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not content:
             return
         
-        # Save message to database
-        message = await self.save_message(content, reply_to_id)
+        # Bursts (pastes, bots) are saved and broadcast together
+        self.pending_messages.append(await self.build_message(content, reply_to_id))
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_messages())
+    
+    async def flush_messages(self):
+        """Save queued messages in one INSERT and broadcast them together."""
+        await asyncio.sleep(MESSAGE_BATCH_WINDOW)
+        batch, self.pending_messages = self.pending_messages, []
+        self.flush_task = None
+        
+        messages = await self.save_messages(batch)
         
-        if message:
-            # Broadcast to room
+        if messages:
+            # Broadcast to room, encoded once here rather than by every receiver
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
-                    'type': 'chat_message',
-                    'message': message,
+                    'type': 'chat_message_batch',
+                    'frame': dumps({
+                        'type': 'messages',
+                        'messages': messages,
+                    }),
                 }
             )
     
@@ -124,9 +169,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             {
                 'type': 'typing_indicator',
-                'user_id': str(self.user.id),
-                'username': self.user.username,
-                'is_typing': is_typing,
+                'user_id': self.user_id,
+                'frame': dumps({
+                    'type': 'typing',
+                    'user_id': self.user_id,
+                    'username': self.user.username,
+                    'is_typing': is_typing,
+                }),
             }
         )
     
@@ -141,7 +190,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.room_group_name,
                 {
                     'type': 'read_receipt',
-                    'user_id': str(self.user.id),
+                    'user_id': self.user_id,
                     'message_id': message_id,
                 }
             )
@@ -164,37 +213,31 @@ class ChatConsumer(AsyncWebsocketConsumer):
     
     # Event handlers for group messages
     
-    async def chat_message(self, event):
-        """Send chat message to WebSocket."""
-        await self.send(text_data=json.dumps({
-            'type': 'message',
-            'message': event['message'],
-        }))
+    async def chat_message_batch(self, event):
+        """Send a batch of chat messages to WebSocket as one frame."""
+        await self.send(text_data=event['frame'])
     
     async def typing_indicator(self, event):
         """Send typing indicator to WebSocket."""
-        # Don't send to the user who is typing
-        if event['user_id'] != str(self.user.id):
-            await self.send(text_data=json.dumps({
-                'type': 'typing',
-                'user_id': event['user_id'],
-                'username': event['username'],
-                'is_typing': event['is_typing'],
-            }))
+        # Don't echo to the user who is typing
+        if event['user_id'] == self.user_id:
+            return
+        await self.send(text_data=event['frame'])
     
     async def user_status(self, event):
         """Send user status update to WebSocket."""
-        if event['user_id'] != str(self.user.id):
-            await self.send(text_data=json.dumps({
-                'type': 'status',
-                'user_id': event['user_id'],
-                'username': event['username'],
-                'is_online': event['is_online'],
-            }))
+        if event['user_id'] == self.user_id:
+            return
+        await self.send(text_data=dumps({
+            'type': 'status',
+            'user_id': event['user_id'],
+            'username': event['username'],
+            'is_online': event['is_online'],
+        }))
     
     async def read_receipt(self, event):
         """Send read receipt to WebSocket."""
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             'type': 'read',
             'user_id': event['user_id'],
             'message_id': event['message_id'],
@@ -202,81 +245,99 @@ class ChatConsumer(AsyncWebsocketConsumer):
     
     async def message_deleted(self, event):
         """Send message deletion notification to WebSocket."""
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             'type': 'deleted',
             'message_id': event['message_id'],
         }))
     
     # Database operations
     
-    @database_sync_to_async
-    def check_participant(self):
+    async def check_participant(self):
         """Check if user is a participant in the conversation."""
-        from .models import Conversation
-        return Conversation.objects.filter(
-            id=self.conversation_id,
-            participants=self.user
-        ).exists()
+        from .models import ConversationParticipant, participant_cache_key
+        
+        # Reconnects within the TTL skip the query; only positive results are
+        # cached, and membership changes delete the key (see signals)
+        cache_key = participant_cache_key(self.conversation_id, self.user.id)
+        if await cache.aget(cache_key):
+            return True
+        
+        is_participant = await ConversationParticipant.objects.filter(
+            conversation_id=self.conversation_id,
+            user=self.user
+        ).aexists()
+        if is_participant:
+            await cache.aset(cache_key, True, PARTICIPANT_CACHE_TTL)
+        return is_participant
     
-    @database_sync_to_async
-    def save_message(self, content, reply_to_id=None):
-        """Save message to database."""
-        from .models import Conversation, Message
+    async def build_message(self, content, reply_to_id=None):
+        """Build an unsaved message from the current user."""
+        from .models import Message
         
+        # Participation was checked in connect(), so the id is trusted as-is
+        message = Message(
+            conversation_id=self.conversation_id,
+            sender=self.user,
+            message_type='text',
+        )
+        message.content = content
+        
+        if reply_to_id:
+            try:
+                # to_dict() renders the reply preview, so load it with its sender
+                message.reply_to = await Message.objects.select_related('sender').aget(
+                    id=reply_to_id,
+                    conversation_id=self.conversation_id
+                )
+            except (Message.DoesNotExist, ValidationError):
+                pass
+        
+        return message
+    
+    async def save_messages(self, messages):
+        """Save messages to database."""
+        from .models import Message, touch_conversation
+        
+        # bulk_create skips Message.save(), so bump the conversation here
         try:
-            conversation = Conversation.objects.get(id=self.conversation_id)
-            
-            message = Message(
-                conversation=conversation,
-                sender=self.user,
-                message_type='text',
-            )
-            message.content = content
-            
-            if reply_to_id:
-                try:
-                    message.reply_to = Message.objects.get(
-                        id=reply_to_id,
-                        conversation=conversation
-                    )
-                except Message.DoesNotExist:
-                    pass
-            
-            message.save()
-            
-            return message.to_dict()
-        except Conversation.DoesNotExist:
-            return None
+            await Message.objects.abulk_create(messages, batch_size=100)
+        except IntegrityError:
+            # The conversation was deleted after this socket connected
+            return []
+        await database_sync_to_async(touch_conversation)(self.conversation_id)
+        
+        decrypted = {}
+        return [message.to_dict(decrypted) for message in messages]
     
-    @database_sync_to_async
-    def mark_message_read(self, message_id):
+    async def mark_message_read(self, message_id):
         """Mark a message as read."""
-        from .models import Message, MessageReadReceipt
+        from .models import MessageReadReceipt
         
+        # One INSERT ... ON CONFLICT DO NOTHING; the FK rejects unknown messages
         try:
-            message = Message.objects.get(id=message_id)
-            MessageReadReceipt.objects.get_or_create(
-                message=message,
-                user=self.user
+            await MessageReadReceipt.objects.abulk_create(
+                [MessageReadReceipt(message_id=message_id, user=self.user)],
+                ignore_conflicts=True
             )
             return True
-        except Message.DoesNotExist:
+        except (IntegrityError, ValidationError):
             return False
     
-    @database_sync_to_async
-    def delete_message(self, message_id):
+    async def delete_message(self, message_id):
         """Delete a message."""
         from .models import Message
         
+        # Attachments are removed by a background worker, so only the
+        # UPDATE is awaited here
         try:
-            message = Message.objects.get(
+            message = await Message.objects.only('id', 'file').aget(
                 id=message_id,
                 sender=self.user
             )
-            message.soft_delete()
-            return True
-        except Message.DoesNotExist:
+        except (Message.DoesNotExist, ValidationError):
             return False
+        await message.asoft_delete()
+        return True
     
     @database_sync_to_async
     def update_user_status(self, online=True):
@@ -315,7 +376,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     
     async def new_message(self, event):
         """Notify user of new message."""
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             'type': 'new_message',
             'conversation_id': event['conversation_id'],
             'message': event['message'],
@@ -323,7 +384,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     
     async def conversation_update(self, event):
         """Notify user of conversation update."""
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=dumps({
             'type': 'conversation_update',
             'conversation_id': event['conversation_id'],
             'update_type': event['update_type'],
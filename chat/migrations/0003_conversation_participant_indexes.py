@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-15 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_conversation_created_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['user', 'is_archived', 'conversation'], name='participant_user_active_idx'),
+        ),
+    ]
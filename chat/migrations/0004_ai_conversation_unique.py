@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-15 10:18
+
+from django.db import migrations, models
+
+
+def detach_duplicate_ai_chats(apps, schema_editor):
+    # Earlier check-then-create starts could race into duplicate AI chats.
+    # Keep the most recently updated one per user and bot (the one the old
+    # lookup returned) and clear ai_model on the rest so nothing is deleted.
+    Conversation = apps.get_model('chat', 'Conversation')
+    seen = set()
+    duplicates = []
+    for conv in Conversation.objects.filter(conversation_type='ai').exclude(
+        ai_model=''
+    ).order_by('-updated_at').only('id', 'created_by_id', 'ai_model'):
+        key = (conv.created_by_id, conv.ai_model)
+        if key in seen:
+            duplicates.append(conv.id)
+        else:
+            seen.add(key)
+    Conversation.objects.filter(id__in=duplicates).update(ai_model='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_conversation_participant_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(detach_duplicate_ai_chats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(condition=models.Q(('conversation_type', 'ai'), models.Q(('ai_model', ''), _negated=True)), fields=('created_by', 'ai_model'), name='ai_conv_unique'),
+        ),
+    ]
@@ -4,28 +4,39 @@ Chat models for messaging functionality.
 
 import uuid
 import os
+import secrets
+from asgiref.sync import sync_to_async
 from django.db import models
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import base64
 import hashlib
 
+from .tasks import delete_file
 
-def get_encryption_key():
-    """Get or generate encryption key."""
-    key = settings.ENCRYPTION_KEY
-    # Ensure key is 32 bytes for Fernet
-    key_bytes = hashlib.sha256(key.encode()).digest()
-    return base64.urlsafe_b64encode(key_bytes)
+
+# Derive keys once; ENCRYPTION_KEY doesn't change at runtime
+_KEY_MATERIAL = hashlib.sha256(settings.ENCRYPTION_KEY.encode()).digest()
+_AESGCM = AESGCM(hashlib.sha256(b'aesgcm:' + _KEY_MATERIAL).digest())
+# Messages stored before the switch to AES-GCM are Fernet tokens
+_FERNET = Fernet(base64.urlsafe_b64encode(_KEY_MATERIAL))
+
+# Prefix marking AES-GCM ciphertexts (base64url of nonce || ciphertext+tag)
+AESGCM_PREFIX = 'v2:'
+AESGCM_NONCE_SIZE = 12
 
 
 def encrypt_message(text):
     """Encrypt message content."""
     if not text:
         return text
-    f = Fernet(get_encryption_key())
-    return f.encrypt(text.encode()).decode()
+    nonce = os.urandom(AESGCM_NONCE_SIZE)
+    sealed = _AESGCM.encrypt(nonce, text.encode(), None)
+    return AESGCM_PREFIX + base64.urlsafe_b64encode(nonce + sealed).decode()
 
 
 def decrypt_message(encrypted_text):
@@ -33,17 +44,132 @@ def decrypt_message(encrypted_text):
     if not encrypted_text:
         return encrypted_text
     try:
-        f = Fernet(get_encryption_key())
-        return f.decrypt(encrypted_text.encode()).decode()
+        if encrypted_text.startswith(AESGCM_PREFIX):
+            raw = base64.urlsafe_b64decode(encrypted_text[len(AESGCM_PREFIX):])
+            nonce, sealed = raw[:AESGCM_NONCE_SIZE], raw[AESGCM_NONCE_SIZE:]
+            return _AESGCM.decrypt(nonce, sealed, None).decode()
+        return _FERNET.decrypt(encrypted_text.encode()).decode()
     except Exception:
         return "[Unable to decrypt message]"
 
 
+# Minimum seconds between updated_at bumps for the same conversation
+CONVERSATION_TOUCH_INTERVAL = 10
+# Columns written when a message is soft deleted
+SOFT_DELETE_FIELDS = ['is_deleted', '_content', 'file', 'updated_at']
+# Seconds a direct conversation's display name is cached per viewer
+DISPLAY_NAME_CACHE_TTL = 300
+
+
+def display_name_cache_key(conversation_id, user_id):
+    return f'disp:{conversation_id}:{user_id}'
+
+
+def participant_cache_key(conversation_id, user_id):
+    return f'participant:{conversation_id}:{user_id}'
+
+
+# Active bots are cached under this key until a bot is saved or deleted
+ACTIVE_AI_BOTS_CACHE_KEY = 'active_ai_bots'
+ACTIVE_AI_BOTS_CACHE_TTL = 300
+
+# Seconds an unread count is cached; keys change on their own, so this
+# only bounds how long abandoned keys linger
+UNREAD_COUNT_CACHE_TTL = 60 * 60 * 24
+
+
+def attach_unread_counts(conversations, user):
+    """
+    Set .unread on conversations loaded with for_chat_list().
+    
+    Counts are cached under the latest message time and the user's read
+    marker, so a new message or a read produces a new key and nothing has
+    to be invalidated. Misses are counted together in one grouped query.
+    """
+    conversations = list(conversations)
+    keys = {
+        conv.pk: f'unread:{user.pk}:{conv.pk}:'
+                 f'{conv.last_message_time.timestamp()}:{conv.last_read_at.timestamp()}'
+        for conv in conversations
+    }
+    counts = cache.get_many(keys.values())
+    
+    misses = [conv for conv in conversations if keys[conv.pk] not in counts]
+    if misses:
+        unread = models.Q()
+        for conv in misses:
+            unread |= models.Q(conversation_id=conv.pk, created_at__gt=conv.last_read_at)
+        fresh = dict(
+            Message.objects.filter(unread).exclude(sender=user)
+            .values('conversation_id').annotate(n=models.Count('id'))
+            .values_list('conversation_id', 'n')
+        )
+        missed = {keys[conv.pk]: fresh.get(conv.pk, 0) for conv in misses}
+        cache.set_many(missed, UNREAD_COUNT_CACHE_TTL)
+        counts.update(missed)
+    
+    for conv in conversations:
+        conv.unread = counts[keys[conv.pk]]
+    return conversations
+
+
+def touch_conversation(conversation_id):
+    """
+    Bump a conversation's updated_at after new activity.
+    
+    Bursts of messages only write once per CONVERSATION_TOUCH_INTERVAL:
+    the cache marker is claimed atomically, so concurrent senders don't
+    all UPDATE the same conversation row.
+    """
+    if not cache.add(f'conv_touch:{conversation_id}', 1, CONVERSATION_TOUCH_INTERVAL):
+        return
+    Conversation.objects.filter(pk=conversation_id).update(updated_at=timezone.now())
+
+
 def chat_file_path(instance, filename):
     """Generate file path for chat attachments."""
-    ext = filename.split('.')[-1]
-    filename = f'{uuid.uuid4().hex}.{ext}'
-    return f'chat_files/{instance.conversation.id}/{filename}'
+    # splitext keeps the dot and returns '' for extensionless names
+    ext = os.path.splitext(filename)[1].lower()
+    filename = f'{secrets.token_urlsafe(12)}{ext}'
+    return f'chat_files/{instance.conversation_id}/{filename}'
+
+
+class ConversationQuerySet(models.QuerySet):
+    """QuerySet helpers for Conversation lookups."""
+    
+    def for_chat_list(self, user):
+        """
+        The user's non-archived conversations with everything a chat list
+        renders loaded up front: participants, the latest message, the
+        user's read marker (last_read_at) and mute flag (is_muted).
+        
+        Pass the results through attach_unread_counts() to set .unread.
+        """
+        from accounts.models import User
+        
+        membership = ConversationParticipant.objects.filter(
+            conversation=models.OuterRef('pk'),
+            user=user
+        )
+        return self.filter(
+            models.Exists(membership.filter(is_archived=False))
+        ).annotate(
+            # Fall back to created_at so conversations without messages still sort
+            last_message_time=Coalesce(models.Max('messages__created_at'), 'created_at'),
+            last_read_at=models.Subquery(membership.values('last_read_at')[:1]),
+            is_muted=models.Subquery(membership.values('is_muted')[:1]),
+        ).prefetch_related(
+            # Only the columns chat lists and ConversationSerializer read
+            models.Prefetch(
+                'participants',
+                queryset=User.objects.only('id', 'username', 'name', 'bio', 'profile_pic', 'last_seen')
+            ),
+            models.Prefetch(
+                'messages',
+                queryset=Message.objects.select_related('sender').order_by('-created_at')[:1],
+                to_attr='latest_messages'
+            )
+        )
 
 
 class Conversation(models.Model):
@@ -79,8 +205,18 @@ class Conversation(models.Model):
     # AI Chat specific
     ai_model = models.CharField(max_length=50, blank=True)  # e.g., 'gpt-4', 'claude'
     
+    objects = ConversationQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-updated_at']
+        constraints = [
+            # One chat per user and bot; also backs start_ai_chat_view's lookup
+            models.UniqueConstraint(
+                fields=['created_by', 'ai_model'],
+                condition=models.Q(conversation_type='ai') & ~models.Q(ai_model=''),
+                name='ai_conv_unique'
+            ),
+        ]
     
     def __str__(self):
         if self.name:
@@ -94,24 +230,49 @@ class Conversation(models.Model):
         """Get display name for a specific user."""
         if self.name:
             return self.name
-        if self.conversation_type == 'direct':
-            other = self.participants.exclude(id=for_user.id).first()
+        if self.conversation_type != 'direct':
+            return "Group Chat"
+        if 'participants' in getattr(self, '_prefetched_objects_cache', {}):
+            other = self.get_other_participant(for_user)
             return other.get_display_name() if other else "Unknown"
-        return "Group Chat"
+        
+        # Unprefetched lookups (search, backups) cost a query each, so cache them
+        key = display_name_cache_key(self.pk, for_user.pk)
+        display_name = cache.get(key)
+        if display_name is None:
+            other = self.get_other_participant(for_user)
+            display_name = other.get_display_name() if other else "Unknown"
+            cache.set(key, display_name, DISPLAY_NAME_CACHE_TTL)
+        return display_name
     
     def get_other_participant(self, user):
         """Get the other participant in a direct message."""
         if self.conversation_type != 'direct':
             return None
-        return self.participants.exclude(id=user.id).first()
+        # Chat lists and get_display_name() both ask, so remember the answer
+        others = self.__dict__.setdefault('_other_participants', {})
+        if user.pk not in others:
+            if 'participants' in getattr(self, '_prefetched_objects_cache', {}):
+                others[user.pk] = next((p for p in self.participants.all() if p.pk != user.pk), None)
+            else:
+                others[user.pk] = self.participants.exclude(id=user.id).first()
+        return others[user.pk]
     
     def get_last_message(self):
         """Get the most recent message."""
+        if hasattr(self, 'latest_messages'):
+            return self.latest_messages[0] if self.latest_messages else None
         return self.messages.order_by('-created_at').first()
     
     def get_unread_count(self, user):
         """Get unread message count for user."""
-        participant = self.conversation_participants.filter(user=user).first()
+        if 'conversation_participants' in getattr(self, '_prefetched_objects_cache', {}):
+            participant = next(
+                (cp for cp in self.conversation_participants.all() if cp.user_id == user.pk),
+                None
+            )
+        else:
+            participant = self.conversation_participants.filter(user=user).first()
         if not participant:
             return 0
         return self.messages.filter(
@@ -121,16 +282,16 @@ class Conversation(models.Model):
     @classmethod
     def get_or_create_direct(cls, user1, user2):
         """Get or create a direct conversation between two users."""
-        # Look for existing conversation
-        conversations = cls.objects.filter(
-            conversation_type='direct',
-            participants=user1
-        ).filter(
-            participants=user2
-        )
+        # Look for existing conversation; EXISTS avoids joining participants twice
+        membership = ConversationParticipant.objects.filter(conversation=models.OuterRef('pk'))
+        conversation = cls.objects.filter(
+            models.Exists(membership.filter(user=user1)),
+            models.Exists(membership.filter(user=user2)),
+            conversation_type='direct'
+        ).first()
         
-        if conversations.exists():
-            return conversations.first(), False
+        if conversation:
+            return conversation, False
         
         # Create new conversation
         conversation = cls.objects.create(
@@ -172,6 +333,10 @@ class ConversationParticipant(models.Model):
     class Meta:
         unique_together = ['conversation', 'user']
         ordering = ['-joined_at']
+        indexes = [
+            # A user's active conversations, driven from the user side
+            models.Index(fields=['user', 'is_archived', 'conversation'], name='participant_user_active_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} in {self.conversation}"
@@ -232,13 +397,28 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Keyset pagination over a conversation's history
+            models.Index(fields=['conversation', '-created_at', '-id'], name='message_conv_created_idx'),
+        ]
     
     @property
     def content(self):
         """Decrypt and return message content."""
+        return self.get_content()
+    
+    def get_content(self, decrypted=None):
+        """
+        Decrypted content, memoized in decrypted (ciphertext -> plaintext)
+        when a dict is shared across a batch of messages.
+        """
         if self.is_deleted:
             return "[Message deleted]"
-        return decrypt_message(self._content)
+        if decrypted is None:
+            return decrypt_message(self._content)
+        if self._content not in decrypted:
+            decrypted[self._content] = decrypt_message(self._content)
+        return decrypted[self._content]
     
     @content.setter
     def content(self, value):
@@ -249,25 +429,47 @@ class Message(models.Model):
         return f"Message from {self.sender} at {self.created_at}"
     
     def save(self, *args, **kwargs):
-        # Update conversation's updated_at
-        if not self.pk:
-            self.conversation.updated_at = timezone.now()
-            self.conversation.save(update_fields=['updated_at'])
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        if adding:
+            touch_conversation(self.conversation_id)
     
-    def soft_delete(self):
-        """Soft delete the message."""
+    def _clear_for_delete(self):
+        """Blank the message in memory and return its attachment, if any."""
+        attachment = self.file or None
         self.is_deleted = True
         self._content = ''
-        if self.file:
-            self.file.delete()
-        self.save()
+        self.file = ''
+        return attachment
     
-    def to_dict(self):
-        """Convert message to dictionary for API/WebSocket."""
+    def soft_delete(self):
+        """Soft delete the message."""
+        attachment = self._clear_for_delete()
+        self.save(update_fields=SOFT_DELETE_FIELDS)
+        # Only once the row no longer points at it
+        if attachment:
+            delete_file(attachment)
+    
+    async def asoft_delete(self):
+        """Async version of soft_delete()."""
+        attachment = self._clear_for_delete()
+        await self.asave(update_fields=SOFT_DELETE_FIELDS)
+        if attachment:
+            # on_commit needs the synchronous connection
+            await sync_to_async(delete_file)(attachment)
+    
+    def to_dict(self, decrypted=None):
+        """
+        Convert message to dictionary for API/WebSocket.
+        
+        Converting a batch, pass one dict as decrypted to every call so a
+        message quoted by replies on the same page is decrypted only once.
+        """
+        if decrypted is None:
+            decrypted = {}
         data = {
             'id': str(self.id),
-            'conversation_id': str(self.conversation.id),
+            'conversation_id': str(self.conversation_id),
             'sender': {
                 'id': str(self.sender.id) if self.sender else None,
                 'username': self.sender.username if self.sender else 'System',
@@ -275,7 +477,7 @@ class Message(models.Model):
                 'profile_pic': self.sender.profile_pic.url if self.sender and self.sender.profile_pic else None,
             },
             'message_type': self.message_type,
-            'content': self.content,
+            'content': self.get_content(decrypted),
             'created_at': self.created_at.isoformat(),
             'is_edited': self.is_edited,
             'is_deleted': self.is_deleted,
@@ -291,7 +493,7 @@ class Message(models.Model):
         if self.reply_to:
             data['reply_to'] = {
                 'id': str(self.reply_to.id),
-                'content': self.reply_to.content[:100],
+                'content': self.reply_to.get_content(decrypted)[:100],
                 'sender': self.reply_to.sender.username if self.reply_to.sender else 'Unknown',
             }
         
@@ -323,6 +525,15 @@ class AIBot(models.Model):
     
     def __str__(self):
         return self.name
+    
+    @classmethod
+    def get_active(cls):
+        """Active bots; cached because they only change through the admin."""
+        return cache.get_or_set(
+            ACTIVE_AI_BOTS_CACHE_KEY,
+            lambda: list(cls.objects.filter(is_active=True)),
+            ACTIVE_AI_BOTS_CACHE_TTL
+        )
 
 
 class ChatBackup(models.Model):
@@ -4,26 +4,22 @@ Serializers for chat API.
 
 from rest_framework import serializers
 from .models import Conversation, Message, ConversationParticipant
-from accounts.models import User
 
 
-class UserSerializer(serializers.ModelSerializer):
-    """Serializer for User model."""
+class UserSerializer(serializers.BaseSerializer):
+    """Read-only serializer for User model."""
     
-    is_online = serializers.SerializerMethodField()
-    profile_pic_url = serializers.SerializerMethodField()
-    
-    class Meta:
-        model = User
-        fields = ['id', 'username', 'name', 'bio', 'profile_pic_url', 'is_online']
-    
-    def get_is_online(self, obj):
-        return obj.is_online
-    
-    def get_profile_pic_url(self, obj):
-        if obj.profile_pic:
-            return obj.profile_pic.url
-        return None
+    def to_representation(self, obj):
+        # Nested in every conversation and message, so build the dict
+        # directly instead of going field by field
+        return {
+            'id': str(obj.id),
+            'username': obj.username,
+            'name': obj.name,
+            'bio': obj.bio,
+            'profile_pic_url': obj.profile_pic.url if obj.profile_pic else None,
+            'is_online': obj.is_online,
+        }
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -70,6 +66,8 @@ class ConversationSerializer(serializers.ModelSerializer):
         return None
     
     def get_unread_count(self, obj):
+        if hasattr(obj, 'unread'):
+            return obj.unread
         request = self.context.get('request')
         if request and request.user:
             return obj.get_unread_count(request.user)
@@ -0,0 +1,37 @@
+"""
+Signal handlers for chat models.
+"""
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import (
+    AIBot, ConversationParticipant, ACTIVE_AI_BOTS_CACHE_KEY,
+    display_name_cache_key, participant_cache_key
+)
+
+
+@receiver([post_save, post_delete], sender=ConversationParticipant)
+def invalidate_membership_caches(sender, instance, created=True, **kwargs):
+    """Drop cached display names and socket access when a conversation's members change."""
+    # Read markers and mute toggles also save participants; those don't matter
+    if not created:
+        return
+    user_ids = set(
+        ConversationParticipant.objects.filter(
+            conversation_id=instance.conversation_id
+        ).values_list('user_id', flat=True)
+    )
+    user_ids.add(instance.user_id)
+    cache.delete_many([
+        display_name_cache_key(instance.conversation_id, user_id) for user_id in user_ids
+    ] + [
+        participant_cache_key(instance.conversation_id, instance.user_id)
+    ])
+
+
+@receiver([post_save, post_delete], sender=AIBot)
+def invalidate_active_ai_bots(sender, **kwargs):
+    """Drop the cached bot list when any bot changes."""
+    cache.delete(ACTIVE_AI_BOTS_CACHE_KEY)
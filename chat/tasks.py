@@ -0,0 +1,35 @@
+"""
+Background storage cleanup.
+
+Attachment deletes are handed to a small worker pool so deleting a
+message never waits on the filesystem or object storage round-trip.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Deletes are rare and cheap to queue; two workers keep up with bursts
+FILE_DELETE_WORKERS = 2
+
+_executor = ThreadPoolExecutor(max_workers=FILE_DELETE_WORKERS, thread_name_prefix='file-delete')
+
+
+def _delete(storage, name):
+    try:
+        storage.delete(name)
+    except Exception:
+        logger.exception('Failed to delete stored file %s', name)
+
+
+def delete_file(field_file):
+    """
+    Queue removal of a FieldFile's stored file once the current transaction
+    commits (right away outside one), so a rolled-back write never leaves a
+    row pointing at a missing file. Call it after the row is updated.
+    """
+    storage, name = field_file.storage, field_file.name
+    transaction.on_commit(lambda: _executor.submit(_delete, storage, name))
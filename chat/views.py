@@ -2,104 +2,175 @@
 Views for chat functionality.
 """
 
-import json
+import gzip
+import hashlib
+import os
+import tempfile
+
+import orjson
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse, FileResponse
+from django.http import JsonResponse, HttpResponse, FileResponse, Http404
 from django.views.decorators.http import require_POST, require_GET
-from django.db.models import Q, Max, Count
+from django.db.models import Q, F, Count, Exists, OuterRef, Prefetch, Subquery
 from django.utils import timezone
-from django.core.paginator import Paginator
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
 
 from .models import (
     Conversation, ConversationParticipant, Message, 
-    AIBot, ChatBackup, MessageReadReceipt
+    AIBot, ChatBackup, MessageReadReceipt, attach_unread_counts
 )
 from accounts.models import User
-from accounts.views import log_activity
+from accounts.activity import log_activity
+
+# Messages fetched per round-trip while writing a backup
+BACKUP_CHUNK_SIZE = 2000
+# gzip level for backup files; past 6 the CPU cost grows faster than the savings
+BACKUP_COMPRESS_LEVEL = 6
+# Conversation columns the chat list and sidebar templates read
+# (updated_at versions the cached sidebar)
+CHAT_LIST_FIELDS = ('id', 'name', 'conversation_type', 'group_image', 'updated_at')
+# Seconds conversation search results are reused
+CHAT_SEARCH_CACHE_TTL = 30
+# Uploads with these extensions are shown inline as images
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'})
+
+
+def get_message_page(conversation, before_id=None, limit=50):
+    """
+    Newest-first page of messages older than before_id.
+    
+    Keyset pagination on (created_at, id) uses the message index directly,
+    so there is no COUNT or OFFSET scan. The cursor's timestamp is read in
+    a subquery of the same SELECT, and one extra row is fetched to tell
+    whether older messages remain.
+    """
+    messages_qs = conversation.messages.select_related(
+        'sender', 'reply_to__sender'
+    ).order_by('-created_at', '-id')
+    
+    if before_id:
+        try:
+            before_time = Subquery(
+                conversation.messages.filter(id=before_id).values('created_at')[:1]
+            )
+            messages_qs = messages_qs.filter(
+                Q(created_at__lt=before_time) |
+                Q(created_at=before_time, id__lt=before_id)
+            )
+        except ValidationError:
+            # Not a message id; ignore the cursor
+            pass
+    
+    page = list(messages_qs[:limit + 1])
+    return page[:limit], len(page) > limit
 
 
 @login_required
 def chat_list_view(request):
     """Display list of all conversations for the user."""
     # Get user's conversations with latest message info
-    conversations = Conversation.objects.filter(
-        participants=request.user,
-        conversation_participants__is_archived=False
-    ).annotate(
-        last_message_time=Max('messages__created_at')
-    ).order_by('-last_message_time', '-updated_at')
+    conversations = attach_unread_counts(
+        Conversation.objects.for_chat_list(request.user).only(
+            *CHAT_LIST_FIELDS
+        ).order_by('-last_message_time', '-updated_at'),
+        request.user
+    )
     
     # Add metadata for each conversation
     chat_data = []
     for conv in conversations:
-        participant = conv.conversation_participants.get(user=request.user)
-        last_msg = conv.get_last_message()
-        
         chat_data.append({
             'conversation': conv,
             'display_name': conv.get_display_name(request.user),
             'other_user': conv.get_other_participant(request.user),
-            'last_message': last_msg,
-            'unread_count': conv.get_unread_count(request.user),
-            'is_muted': participant.is_muted,
+            'last_message': conv.get_last_message(),
+            'unread_count': conv.unread,
+            'is_muted': conv.is_muted,
         })
     
-    # Get AI bots for sidebar
-    ai_bots = AIBot.objects.filter(is_active=True)
-    
     return render(request, 'chat/chat_list.html', {
         'chats': chat_data,
-        'ai_bots': ai_bots,
+        # AI bots for sidebar; templates call this only if they render them
+        'ai_bots': AIBot.get_active,
     })
 
 
 @login_required
 def chat_view(request, conversation_id):
     """Display a specific conversation."""
+    # Memberships with their users feed the members panel, the member
+    # count, the viewer's own row and the other side of a direct chat
     conversation = get_object_or_404(
-        Conversation.objects.prefetch_related('participants'),
+        Conversation.objects.prefetch_related(
+            Prefetch(
+                'conversation_participants',
+                queryset=ConversationParticipant.objects.select_related('user')
+            )
+        ),
         id=conversation_id,
         participants=request.user
     )
+    memberships = conversation.conversation_participants.all()
     
     # Mark as read
-    participant = conversation.conversation_participants.get(user=request.user)
+    participant = next(cp for cp in memberships if cp.user_id == request.user.id)
     participant.mark_as_read()
     
+    other_user = None
+    if conversation.conversation_type == 'direct':
+        other_user = next((cp.user for cp in memberships if cp.user_id != request.user.id), None)
+    
     # Get messages with pagination
-    messages_qs = conversation.messages.select_related('sender').order_by('-created_at')
-    paginator = Paginator(messages_qs, 50)
-    page = request.GET.get('page', 1)
-    messages_page = paginator.get_page(page)
+    messages_page, has_more = get_message_page(conversation, request.GET.get('before'))
     
     # Get all user conversations for sidebar
-    all_conversations = Conversation.objects.filter(
-        participants=request.user,
-        conversation_participants__is_archived=False
-    ).annotate(
-        last_message_time=Max('messages__created_at')
-    ).order_by('-last_message_time')[:20]
-    
-    sidebar_chats = []
-    for conv in all_conversations:
-        sidebar_chats.append({
+    all_conversations = attach_unread_counts(
+        Conversation.objects.for_chat_list(request.user).only(
+            *CHAT_LIST_FIELDS
+        ).order_by('-last_message_time')[:20],
+        request.user
+    )
+    
+    # The template caches the rendered sidebar under this version, built
+    # from everything it shows: which chats are listed, their names
+    # (group renames, peers' display names), the last message (new, edited
+    # or deleted) and unread counts. It reads only what is already loaded.
+    sidebar_version = repr([
+        (
+            conv.id,
+            conv.updated_at,
+            conv.get_display_name(request.user),
+            last_message and (last_message.id, last_message.updated_at),
+            conv.unread,
+        )
+        for conv in all_conversations
+        for last_message in [conv.get_last_message()]
+    ])
+    
+    def sidebar_chats():
+        # Called by the template only when the cached fragment is missing
+        return [{
             'conversation': conv,
             'display_name': conv.get_display_name(request.user),
             'other_user': conv.get_other_participant(request.user),
             'last_message': conv.get_last_message(),
-            'unread_count': conv.get_unread_count(request.user),
+            'unread_count': conv.unread,
             'is_active': conv.id == conversation.id,
-        })
+        } for conv in all_conversations]
     
     return render(request, 'chat/chat_room.html', {
         'conversation': conversation,
-        'chat_messages': reversed(list(messages_page)),
-        'has_more': messages_page.has_next(),
-        'other_user': conversation.get_other_participant(request.user),
+        'chat_messages': messages_page[::-1],
+        'has_more': has_more,
+        'other_user': other_user,
         'sidebar_chats': sidebar_chats,
+        'sidebar_version': sidebar_version,
         'participant': participant,
     })
 
@@ -137,46 +208,40 @@ def create_group_view(request):
         if len(participant_ids) < 1:
             return JsonResponse({'error': 'Select at least one participant'}, status=400)
         
-        # Create group conversation
-        conversation = Conversation.objects.create(
-            name=name,
-            description=description,
-            conversation_type='group',
-            created_by=request.user
-        )
-        
-        # Handle group image
-        if 'group_image' in request.FILES:
-            conversation.group_image = request.FILES['group_image']
-            conversation.save()
-        
-        # Add creator as owner
-        ConversationParticipant.objects.create(
-            conversation=conversation,
-            user=request.user,
-            role='owner'
-        )
-        
-        # Add participants
-        for user_id in participant_ids:
-            try:
-                user = User.objects.get(id=user_id, is_active=True)
-                if user != request.user:
-                    ConversationParticipant.objects.create(
-                        conversation=conversation,
-                        user=user,
-                        role='member'
-                    )
-            except User.DoesNotExist:
-                continue
+        try:
+            member_ids = list(User.objects.filter(
+                id__in=participant_ids,
+                is_active=True
+            ).exclude(id=request.user.id).values_list('id', flat=True))
+        except ValidationError:
+            return JsonResponse({'error': 'Invalid participant'}, status=400)
         
-        # Create system message
-        Message.objects.create(
-            conversation=conversation,
-            sender=request.user,
-            message_type='system',
-            content=f'{request.user.get_display_name()} created the group "{name}"'
-        )
+        with transaction.atomic():
+            # Create group conversation
+            conversation = Conversation.objects.create(
+                name=name,
+                description=description,
+                conversation_type='group',
+                created_by=request.user,
+                group_image=request.FILES.get('group_image')
+            )
+            
+            # Add creator as owner and participants in one INSERT
+            ConversationParticipant.objects.bulk_create([
+                ConversationParticipant(conversation=conversation, user=request.user, role='owner'),
+                *(
+                    ConversationParticipant(conversation=conversation, user_id=user_id, role='member')
+                    for user_id in member_ids
+                ),
+            ])
+            
+            # Create system message
+            Message.objects.create(
+                conversation=conversation,
+                sender=request.user,
+                message_type='system',
+                content=f'{request.user.get_display_name()} created the group "{name}"'
+            )
         
         log_activity(request.user, 'group_created', request, {
             'group_id': str(conversation.id),
@@ -197,41 +262,45 @@ def start_ai_chat_view(request, bot_id):
     """Start a chat with an AI bot."""
     bot = get_object_or_404(AIBot, id=bot_id, is_active=True)
     
-    # Check for existing AI conversation
-    existing = Conversation.objects.filter(
-        conversation_type='ai',
-        created_by=request.user,
-        ai_model=bot.model_name
-    ).first()
-    
-    if existing:
-        return redirect('chat:chat_room', conversation_id=existing.id)
-    
-    # Create new AI conversation
-    conversation = Conversation.objects.create(
-        name=f"Chat with {bot.name}",
-        conversation_type='ai',
-        created_by=request.user,
-        ai_model=bot.model_name
-    )
-    
-    ConversationParticipant.objects.create(
-        conversation=conversation,
-        user=request.user,
-        role='owner'
-    )
-    
-    # Add welcome message from AI
-    Message.objects.create(
-        conversation=conversation,
-        sender=None,  # AI messages have no sender
-        message_type='ai',
-        content=f"Hello! I'm {bot.name}. How can I help you today?"
-    )
+    # Reuse the existing AI conversation; the ai_conv_unique constraint
+    # makes concurrent starts resolve to the same row
+    with transaction.atomic():
+        conversation, created = Conversation.objects.get_or_create(
+            conversation_type='ai',
+            created_by=request.user,
+            ai_model=bot.model_name,
+            defaults={'name': f"Chat with {bot.name}"}
+        )
+        
+        if created:
+            ConversationParticipant.objects.create(
+                conversation=conversation,
+                user=request.user,
+                role='owner'
+            )
+            
+            # Add welcome message from AI
+            Message.objects.create(
+                conversation=conversation,
+                sender=None,  # AI messages have no sender
+                message_type='ai',
+                content=f"Hello! I'm {bot.name}. How can I help you today?"
+            )
     
     return redirect('chat:chat_room', conversation_id=conversation.id)
 
 
+def get_upload_message_type(file):
+    """
+    'image' or 'file' for an upload, judged by its extension.
+    
+    Storage serves files by extension, so this matches what browsers will
+    render, unlike the client-supplied Content-Type header.
+    """
+    ext = os.path.splitext(file.name)[1].lower()
+    return 'image' if ext in IMAGE_EXTENSIONS else 'file'
+
+
 @login_required
 @require_POST
 def send_message_view(request, conversation_id):
@@ -255,7 +324,7 @@ def send_message_view(request, conversation_id):
     message = Message(
         conversation=conversation,
         sender=request.user,
-        message_type='text' if not file else ('image' if file.content_type.startswith('image/') else 'file')
+        message_type=get_upload_message_type(file) if file else 'text'
     )
     
     if content:
@@ -268,11 +337,11 @@ def send_message_view(request, conversation_id):
     
     if reply_to_id:
         try:
-            message.reply_to = Message.objects.get(
+            message.reply_to = Message.objects.select_related('sender').get(
                 id=reply_to_id,
                 conversation=conversation
             )
-        except Message.DoesNotExist:
+        except (Message.DoesNotExist, ValidationError):
             pass
     
     message.save()
@@ -296,23 +365,13 @@ def load_more_messages_view(request, conversation_id):
         participants=request.user
     )
     
-    before_id = request.GET.get('before')
     limit = int(request.GET.get('limit', 50))
+    page, has_more = get_message_page(conversation, request.GET.get('before'), limit)
     
-    messages_qs = conversation.messages.select_related('sender').order_by('-created_at')
-    
-    if before_id:
-        try:
-            before_msg = Message.objects.get(id=before_id)
-            messages_qs = messages_qs.filter(created_at__lt=before_msg.created_at)
-        except Message.DoesNotExist:
-            pass
-    
-    messages_qs = messages_qs[:limit]
-    
+    decrypted = {}
     return JsonResponse({
-        'messages': [m.to_dict() for m in reversed(list(messages_qs))],
-        'has_more': messages_qs.count() == limit
+        'messages': [m.to_dict(decrypted) for m in reversed(page)],
+        'has_more': has_more
     })
 
 
@@ -320,13 +379,21 @@ def load_more_messages_view(request, conversation_id):
 @require_POST
 def delete_message_view(request, message_id):
     """Delete a message."""
-    message = get_object_or_404(Message, id=message_id)
-    
-    # Check permission
-    if message.sender != request.user:
-        return JsonResponse({'error': 'Permission denied'}, status=403)
-    
-    message.soft_delete()
+    # The sender filter is the permission check
+    own_message = Message.objects.filter(id=message_id, sender=request.user)
+    
+    # Text messages, the common case, are blanked by a single UPDATE
+    updated = own_message.filter(file='').update(
+        is_deleted=True,
+        _content='',
+        updated_at=timezone.now()
+    )
+    if not updated:
+        # Attachments need their file name so the file can be removed too
+        message = own_message.only('id', 'file').first()
+        if message is None:
+            return JsonResponse({'error': 'Permission denied'}, status=403)
+        message.soft_delete()
     
     return JsonResponse({'success': True})
 
@@ -335,14 +402,14 @@ def delete_message_view(request, message_id):
 @require_POST
 def mark_read_view(request, conversation_id):
     """Mark conversation as read."""
-    conversation = get_object_or_404(
-        Conversation,
-        id=conversation_id,
-        participants=request.user
-    )
+    # The membership row is the permission check: no row, nothing updated
+    updated = ConversationParticipant.objects.filter(
+        conversation_id=conversation_id,
+        user=request.user
+    ).update(last_read_at=timezone.now())
     
-    participant = conversation.conversation_participants.get(user=request.user)
-    participant.mark_as_read()
+    if not updated:
+        raise Http404
     
     return JsonResponse({'success': True})
 
@@ -355,14 +422,24 @@ def search_chats_view(request):
     if len(query) < 2:
         return JsonResponse({'results': []})
     
-    # Search in conversation names and participants
+    # The sidebar searches as the user types, so reuse recent results briefly
+    query_hash = hashlib.md5(query.lower().encode()).hexdigest()
+    cache_key = f'csearch:{request.user.id}:{query_hash}'
+    results = cache.get(cache_key)
+    if results is not None:
+        return JsonResponse({'results': results})
+    
+    # Search in conversation names and participants; EXISTS semi-joins
+    # need no DISTINCT over a participants join
+    members = ConversationParticipant.objects.filter(conversation=OuterRef('pk'))
     conversations = Conversation.objects.filter(
-        participants=request.user
+        Exists(members.filter(user=request.user))
     ).filter(
         Q(name__icontains=query) |
-        Q(participants__username__icontains=query) |
-        Q(participants__name__icontains=query)
-    ).distinct()[:10]
+        Exists(members.filter(
+            Q(user__username__icontains=query) | Q(user__name__icontains=query)
+        ))
+    ).only(*CHAT_LIST_FIELDS).prefetch_related('participants')[:10]
     
     results = []
     for conv in conversations:
@@ -372,48 +449,66 @@ def search_chats_view(request):
             'name': conv.get_display_name(request.user),
             'conversation_type': conv.conversation_type,
         })
+    cache.set(cache_key, results, CHAT_SEARCH_CACHE_TTL)
     
     return JsonResponse({'results': results})
 
 
+def toggle_participant_flag(user, conversation_id, field):
+    """
+    Flip a boolean on the user's membership in one UPDATE and return the
+    new value. Raises Http404 if the user is not a participant.
+    """
+    membership = ConversationParticipant.objects.filter(
+        conversation_id=conversation_id,
+        user=user
+    )
+    if not membership.update(**{field: ~F(field)}):
+        raise Http404
+    return membership.values_list(field, flat=True).get()
+
+
 @login_required
 def archive_chat_view(request, conversation_id):
     """Archive a conversation."""
-    conversation = get_object_or_404(
-        Conversation,
-        id=conversation_id,
-        participants=request.user
-    )
-    
-    participant = conversation.conversation_participants.get(user=request.user)
-    participant.is_archived = not participant.is_archived
-    participant.save()
-    
     return JsonResponse({
         'success': True,
-        'is_archived': participant.is_archived
+        'is_archived': toggle_participant_flag(request.user, conversation_id, 'is_archived')
     })
 
 
 @login_required
 def mute_chat_view(request, conversation_id):
     """Mute/unmute a conversation."""
-    conversation = get_object_or_404(
-        Conversation,
-        id=conversation_id,
-        participants=request.user
-    )
-    
-    participant = conversation.conversation_participants.get(user=request.user)
-    participant.is_muted = not participant.is_muted
-    participant.save()
-    
     return JsonResponse({
         'success': True,
-        'is_muted': participant.is_muted
+        'is_muted': toggle_participant_flag(request.user, conversation_id, 'is_muted')
     })
 
 
+def write_conversation_backup(out, conversation, user):
+    """Write one conversation and its messages to out as a JSON object."""
+    out.write(b'{"conversation":')
+    out.write(orjson.dumps({
+        'id': str(conversation.id),
+        'name': conversation.get_display_name(user),
+        'type': conversation.conversation_type,
+    }))
+    out.write(b',"messages":[')
+    messages_qs = conversation.messages.select_related(
+        'sender', 'reply_to__sender'
+    ).order_by('created_at', 'id')
+    for i, message in enumerate(messages_qs.iterator(chunk_size=BACKUP_CHUNK_SIZE)):
+        if i:
+            out.write(b',')
+        # Replies mostly quote recent messages; start afresh each chunk so
+        # memory stays flat
+        if i % BACKUP_CHUNK_SIZE == 0:
+            decrypted = {}
+        out.write(orjson.dumps(message.to_dict(decrypted)))
+    out.write(b']}')
+
+
 @login_required
 def create_backup_view(request, conversation_id=None):
     """Create a chat backup."""
@@ -434,39 +529,27 @@ def create_backup_view(request, conversation_id=None):
     
     # Process backup (in production, this would be a background task)
     try:
-        import json
-        from io import BytesIO
-        
-        if conversation:
-            messages_qs = conversation.messages.all()
-            data = {
-                'conversation': {
-                    'id': str(conversation.id),
-                    'name': conversation.get_display_name(request.user),
-                    'type': conversation.conversation_type,
-                },
-                'messages': [m.to_dict() for m in messages_qs]
-            }
-        else:
-            # Backup all conversations
-            data = {'conversations': []}
-            for conv in request.user.conversations.all():
-                conv_data = {
-                    'conversation': {
-                        'id': str(conv.id),
-                        'name': conv.get_display_name(request.user),
-                        'type': conv.conversation_type,
-                    },
-                    'messages': [m.to_dict() for m in conv.messages.all()]
-                }
-                data['conversations'].append(conv_data)
-        
-        # Create JSON file
-        json_content = json.dumps(data, indent=2, default=str)
+        # The backup id keeps names unique; on a clash storage would insert
+        # its random suffix before ".gz" and break the content type
+        filename = f'backup_{request.user.username}_{timezone.now().strftime("%Y%m%d_%H%M%S")}_{backup.pk}.json.gz'
         
-        from django.core.files.base import ContentFile
-        filename = f'backup_{request.user.username}_{timezone.now().strftime("%Y%m%d_%H%M%S")}.json'
-        backup.file.save(filename, ContentFile(json_content.encode()))
+        # Stream through gzip to a temporary file so memory stays flat for
+        # long histories and the stored file is a fraction of the JSON size
+        with tempfile.TemporaryFile() as tmp:
+            with gzip.GzipFile(fileobj=tmp, mode='wb', compresslevel=BACKUP_COMPRESS_LEVEL) as out:
+                if conversation:
+                    write_conversation_backup(out, conversation, request.user)
+                else:
+                    # Backup all conversations
+                    out.write(b'{"conversations":[')
+                    for i, conv in enumerate(request.user.conversations.all()):
+                        if i:
+                            out.write(b',')
+                        write_conversation_backup(out, conv, request.user)
+                    out.write(b']}')
+            
+            tmp.seek(0)
+            backup.file.save(filename, File(tmp))
         
         backup.status = 'completed'
         backup.completed_at = timezone.now()
@@ -498,8 +581,19 @@ def download_backup_view(request, backup_id):
     if not backup.file:
         return JsonResponse({'error': 'Backup file not found'}, status=404)
     
+    filename = backup.file.name.split('/')[-1]
+    
+    # Let nginx send the file so the worker is freed immediately
+    if settings.PROTECTED_MEDIA_URL and not settings.DEBUG:
+        # Backups made before compression was added are plain JSON
+        content_type = 'application/gzip' if filename.endswith('.gz') else 'application/json'
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = f'{settings.PROTECTED_MEDIA_URL}{backup.file.name}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
     return FileResponse(
         backup.file.open('rb'),
         as_attachment=True,
-        filename=backup.file.name.split('/')[-1]
+        filename=filename
     )
@@ -9,7 +9,7 @@ from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 
 from accounts.forms import ProfileUpdateForm, PasswordChangeForm, DeleteAccountForm
-from accounts.views import log_activity
+from accounts.activity import log_activity
 
 
 def home_view(request):
@@ -78,7 +78,9 @@ ASGI_APPLICATION = 'messenger.asgi.application'
 # Channels configuration
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        # Pub/sub delivers a group_send as a single PUBLISH instead of the
+        # core layer's trim/read/pipeline/eval round-trips per send
+        'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
         'CONFIG': {
             'hosts': [os.environ.get('REDIS_URL', 'redis://localhost:6379')],
         },
@@ -87,6 +89,19 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Cache configuration
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_CACHE_URL', os.environ.get('REDIS_URL')),
+    } if os.environ.get('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Presence keys are only authoritative when every process shares the cache
+PRESENCE_FROM_CACHE = bool(os.environ.get('REDIS_URL'))
+
 # Database
 DATABASE_URL = os.environ.get('DATABASE_URL')
 if DATABASE_URL:
@@ -129,6 +144,10 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Internal nginx location aliased to MEDIA_ROOT; when set, backup downloads
+# are handed to nginx with X-Accel-Redirect instead of streamed by Django
+PROTECTED_MEDIA_URL = os.environ.get('PROTECTED_MEDIA_URL', '')
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -149,9 +168,17 @@ DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@messenger.app
 # Message Encryption
 ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY', 'your-32-byte-encryption-key-here!')
 
+# Activity log retention (see the prune_activity_logs command)
+ACTIVITY_LOG_RETENTION_DAYS = int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', 90))
+
 # Session Configuration
 SESSION_COOKIE_AGE = 60 * 60 * 24 * 30  # 30 days
 SESSION_SAVE_EVERY_REQUEST = True
+if os.environ.get('REDIS_URL'):
+    # Read sessions from Redis so authenticated requests skip the session
+    # table; the database copy survives cache flushes and evictions
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+    SESSION_CACHE_ALIAS = 'default'
 
 # REST Framework
 REST_FRAMEWORK = {